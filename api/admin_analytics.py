@@ -0,0 +1,66 @@
+# api/admin_analytics.py
+# Consultas analíticas sobre el archivo Parquet (no tocan Postgres)
+from datetime import date
+
+import pandas as pd
+from fastapi import APIRouter, HTTPException, Header
+
+from admin_upload import verificar_admin_token
+from snapshot_archive import NUM_COLS, resumen_por_dia, tendencia_asesor
+
+router = APIRouter(prefix="/admin/analytics", tags=["admin"])
+
+
+def _columnas(cols: str | None) -> list[str]:
+    if not cols:
+        return NUM_COLS
+    # Sin repetidos (pyarrow no admite dos veces la misma columna)
+    out = list(dict.fromkeys(c.strip() for c in cols.split(",") if c.strip()))
+    invalidas = [c for c in out if c not in NUM_COLS]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Columnas no válidas: {', '.join(invalidas)}")
+    return out
+
+
+def _rango_mes(mes: str | None) -> tuple[date, date]:
+    # mes = "YYYY-MM"; por defecto el mes en curso hasta hoy
+    hoy = pd.Timestamp.today().normalize()
+    if not mes:
+        return hoy.replace(day=1).date(), hoy.date()
+    try:
+        inicio = pd.Timestamp(f"{mes}-01")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Mes inválido (usa YYYY-MM)")
+    fin = min(inicio + pd.offsets.MonthEnd(0), hoy)
+    return inicio.date(), fin.date()
+
+
+@router.get("/mes")
+def resumen_mes(
+    mes: str | None = None,
+    cols: str | None = None,
+    x_admin_token: str | None = Header(default=None),
+):
+    """Totales por dia y acumulado del mes a la fecha = último dia con datos (?mes=YYYY-MM&cols=pp_total,ss_total)."""
+    verificar_admin_token(x_admin_token)
+    desde, hasta = _rango_mes(mes)
+    return {"desde": str(desde), "hasta": str(hasta), **resumen_por_dia(desde, hasta, _columnas(cols))}
+
+
+@router.get("/asesor/{dni}")
+def tendencia(
+    dni: str,
+    desde: date | None = None,
+    hasta: date | None = None,
+    cols: str | None = None,
+    x_admin_token: str | None = Header(default=None),
+):
+    """Serie diaria de un asesor; por defecto el mes en curso."""
+    verificar_admin_token(x_admin_token)
+    if not dni.isdigit() or not (6 <= len(dni) <= 12):
+        raise HTTPException(status_code=400, detail="DNI inválido")
+
+    inicio_mes, hoy = _rango_mes(None)
+    desde = desde or inicio_mes
+    hasta = hasta or hoy
+    return {"dni": dni, "serie": tendencia_asesor(dni, desde, hasta, _columnas(cols))}
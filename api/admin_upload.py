@@ -1,10 +1,21 @@
 # api/admin_upload.py
-import io
+import fcntl
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
 import pandas as pd
-from fastapi import APIRouter, UploadFile, File, HTTPException, Header
+from fastapi import APIRouter, UploadFile, File, HTTPException, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import text
 from db import engine
+import snapshot_bus
+from schemas import CargaInicio
+from snapshot_archive import archivar_snapshot
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -17,6 +28,32 @@ REQUIRED_COLS = [
     "meta_ene_pp","meta_ene_ss","meta_feb_pp","meta_feb_ss",
 ]
 
+# Libro de cargas procesadas (sha256 del archivo + dia forzado)
+LEDGER_TABLE = "club_power_cargas"
+
+# Lectura/escritura en bloques para hashear sin cargar todo de golpe
+READ_CHUNK = 1024 * 1024
+
+# Subidas reanudables: partes en disco local (compartido por los workers
+# del mismo host). Las que no se completan se borran pasado el TTL.
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", Path(tempfile.gettempdir()) / "club_power_uploads"))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_TTL_SECONDS = 24 * 3600
+
+# Serializa las cargas entre workers (TRUNCATE + UPSERT + libro)
+CARGA_LOCK_KEY = 740_001
+
+def verificar_admin_token(x_admin_token: str | None):
+    # 🔒 Seguridad mínima por token
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=500, detail="ADMIN_TOKEN no configurado en el servidor.")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado.")
+
+def _dia_d1():
+    return (pd.Timestamp.today().normalize() - pd.Timedelta(days=1)).date()
+
 def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     df.columns = [" ".join(c.strip().lower().split()) for c in df.columns]
     return df
@@ -51,8 +88,7 @@ def _validate_and_clean(df: pd.DataFrame) -> pd.DataFrame:
     df["ss_total"] = df["ss_vr"] + df["opp"] + df["oss"]
 
     # Forzar D-1 para todos
-    d1 = (pd.Timestamp.today().normalize() - pd.Timedelta(days=1)).date()
-    df["dia"] = d1
+    df["dia"] = _dia_d1()
 
     # Dedup por dni
     df = df.drop_duplicates(subset=["dni"], keep="last").reset_index(drop=True)
@@ -90,28 +126,37 @@ def _upsert_df(conn, df: pd.DataFrame):
             updated_at = now();
     """)
     conn.execute(sql, df.to_dict(orient="records"))
+    snapshot_bus.track_dnis(conn, df["dni"])
 
-@router.post("/cargar-base")
-async def cargar_base(
-    file: UploadFile = File(...),
-    x_admin_token: str | None = Header(default=None),
-):
-    # 🔒 Seguridad mínima por token
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if not ADMIN_TOKEN:
-        raise HTTPException(status_code=500, detail="ADMIN_TOKEN no configurado en el servidor.")
-    if x_admin_token != ADMIN_TOKEN:
-        raise HTTPException(status_code=401, detail="No autorizado.")
+def _ultima_carga(conn, dia):
+    return conn.execute(
+        text(f"""
+            SELECT sha256, resultado
+            FROM public.{LEDGER_TABLE}
+            WHERE dia = :dia
+            ORDER BY created_at DESC
+            LIMIT 1
+        """),
+        {"dia": dia},
+    ).mappings().first()
 
-    filename = (file.filename or "").lower()
-    content = await file.read()
+def _carga_repetida(sha256: str):
+    """Resultado previo si el snapshot vigente (D-1) salió de este mismo archivo."""
+    with engine.connect() as conn:
+        row = _ultima_carga(conn, _dia_d1())
+    if row and row["sha256"] == sha256:
+        return {**row["resultado"], "repetido": True}
+    return None
 
+def _leer_archivo(src, filename: str) -> pd.DataFrame:
+    # src: archivo abierto en binario (pandas detecta el formato por contenido)
+    filename = filename.lower()
     try:
         if filename.endswith((".xlsx", ".xls")):
-            df = pd.read_excel(io.BytesIO(content), dtype=str)
+            df = pd.read_excel(src, dtype=str)
         elif filename.endswith(".csv"):
             # Tu CSV es separado por comas
-            df = pd.read_csv(io.BytesIO(content), dtype=str, sep=",")
+            df = pd.read_csv(src, dtype=str, sep=",")
         else:
             raise HTTPException(status_code=400, detail="Formato no soportado. Sube .csv o .xlsx")
     except Exception as e:
@@ -124,10 +169,215 @@ async def cargar_base(
 
     if len(df) == 0:
         raise HTTPException(status_code=400, detail="El archivo no tiene filas válidas.")
+    return df
 
-    # ✅ TRUNCATE + UPSERT en una sola transacción
+def _cargar(df: pd.DataFrame, sha256: str, filename: str) -> dict:
+    dia = df["dia"].iloc[0]
+    resultado = {"ok": True, "filas_cargadas": int(len(df)), "dia_forzado": str(dia)}
+
+    # ✅ TRUNCATE + UPSERT + libro en una sola transacción
     with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": CARGA_LOCK_KEY})
+
+        # Un reintento que esperó al lock encuentra la carga ya hecha
+        row = _ultima_carga(conn, dia)
+        if row and row["sha256"] == sha256:
+            return {**row["resultado"], "repetido": True}
+
         conn.execute(text(f"TRUNCATE TABLE public.{TABLE_NAME} RESTART IDENTITY;"))
+        # Tras el TRUNCATE cambia toda la tabla: un solo flush total (y
+        # track_dnis() de _upsert_df ya no acumula nada)
+        snapshot_bus.publish_invalidation(conn, "cargar_base", full=True)
         _upsert_df(conn, df)
+        conn.execute(
+            text(f"""
+                INSERT INTO public.{LEDGER_TABLE} (sha256, dia, filename, filas, resultado)
+                VALUES (:sha256, :dia, :filename, :filas, CAST(:resultado AS jsonb))
+                ON CONFLICT (sha256, dia) DO UPDATE SET
+                    filename = EXCLUDED.filename,
+                    filas = EXCLUDED.filas,
+                    resultado = EXCLUDED.resultado,
+                    created_at = now();
+            """),
+            {
+                "sha256": sha256,
+                "dia": dia,
+                "filename": filename[:255],
+                "filas": int(len(df)),
+                "resultado": json.dumps(resultado),
+            },
+        )
+        snapshot_bus.publish(conn, "cargar_base", dia=dia, filas=len(df))
+
+    # 📦 Archivo histórico (Parquet); si falla, la carga ya quedó en BD
+    archivado = True
+    try:
+        archivar_snapshot(df)
+    except Exception as e:
+        archivado = False
+        print(f"⚠️ No se pudo archivar el snapshot: {e}")
+
+    return {**resultado, "archivado": archivado}
+
+# def (no async): pandas, el lock de carga y el upsert bloquean; FastAPI
+# lo corre en el threadpool y el loop sigue atendiendo SSE, /ready, etc.
+@router.post("/cargar-base")
+def cargar_base(
+    file: UploadFile = File(...),
+    x_admin_token: str | None = Header(default=None),
+):
+    verificar_admin_token(x_admin_token)
+
+    filename = file.filename or ""
+
+    # SHA-256 en bloques sobre el temporal que ya guardó Starlette
+    h = hashlib.sha256()
+    while chunk := file.file.read(READ_CHUNK):
+        h.update(chunk)
+    sha256 = h.hexdigest()
+
+    # Mismo archivo ya cargado hoy: no se vuelve a leer ni a bloquear la tabla
+    previo = _carga_repetida(sha256)
+    if previo:
+        return previo
+
+    file.file.seek(0)
+    df = _leer_archivo(file.file, filename)
+    return _cargar(df, sha256, filename)
+
+# -------------------------------------------------------------
+# Subida reanudable por partes
+#   POST /admin/cargas                    -> upload_id (o resultado previo si sha256 coincide)
+#   PUT  /admin/cargas/{id} + Upload-Offset -> agrega una parte en ese offset
+#   GET  /admin/cargas/{id}               -> offset confirmado (para reanudar)
+#   POST /admin/cargas/{id}/completar     -> verifica sha256 y carga
+# -------------------------------------------------------------
+def _upload_paths(upload_id: str):
+    if not upload_id.isalnum():
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    base = UPLOAD_DIR / upload_id
+    if not base.is_dir():
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    return base / "meta.json", base / "data.part"
+
+def _estado_upload(upload_id: str) -> dict:
+    meta_path, data_path = _upload_paths(upload_id)
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    return {**meta, "upload_id": upload_id, "offset": data_path.stat().st_size}
+
+def _limpiar_uploads_viejos():
+    if not UPLOAD_DIR.exists():
+        return
+    limite = time.time() - UPLOAD_TTL_SECONDS
+    for d in UPLOAD_DIR.iterdir():
+        # La mtime del directorio no cambia al agregar partes a data.part:
+        # se mide la última parte recibida, no la creación de la subida.
+        data = d / "data.part"
+        try:
+            ultima = data.stat().st_mtime if data.exists() else d.stat().st_mtime
+            if d.is_dir() and ultima < limite:
+                shutil.rmtree(d, ignore_errors=True)
+        except OSError:
+            pass
+
+@router.post("/cargas")
+def iniciar_carga(
+    body: CargaInicio,
+    x_admin_token: str | None = Header(default=None),
+):
+    verificar_admin_token(x_admin_token)
+
+    if not body.filename.lower().endswith((".xlsx", ".xls", ".csv")):
+        raise HTTPException(status_code=400, detail="Formato no soportado. Sube .csv o .xlsx")
+
+    if body.sha256:
+        previo = _carga_repetida(body.sha256.lower())
+        if previo:
+            return previo
+
+    _limpiar_uploads_viejos()
+
+    upload_id = uuid.uuid4().hex
+    base = UPLOAD_DIR / upload_id
+    base.mkdir(parents=True)
+    (base / "meta.json").write_text(json.dumps(body.model_dump()), encoding="utf-8")
+    (base / "data.part").touch()
+
+    return {"upload_id": upload_id, "offset": 0, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+@router.get("/cargas/{upload_id}")
+def estado_carga(
+    upload_id: str,
+    x_admin_token: str | None = Header(default=None),
+):
+    verificar_admin_token(x_admin_token)
+    return _estado_upload(upload_id)
+
+def _sincronizar(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+@router.put("/cargas/{upload_id}")
+async def subir_parte(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    x_admin_token: str | None = Header(default=None),
+):
+    verificar_admin_token(x_admin_token)
+    meta_path, data_path = _upload_paths(upload_id)
+    size = json.loads(meta_path.read_text(encoding="utf-8"))["size"]
+
+    with open(data_path, "ab") as f:
+        # Un solo escritor por subida, aunque el reintento caiga en otro worker
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise HTTPException(status_code=409, detail="Hay otra parte subiéndose para esta carga.")
+        offset = f.seek(0, os.SEEK_END)
+        if upload_offset != offset:
+            raise HTTPException(status_code=409, detail={"error": "Offset no coincide.", "offset": offset})
+
+        # Escritura y fsync fuera del loop: un disco lento no frena a los demás
+        async for chunk in request.stream():
+            if offset + len(chunk) > size:
+                await run_in_threadpool(f.truncate, upload_offset)
+                raise HTTPException(status_code=400, detail="La parte excede el tamaño declarado.")
+            await run_in_threadpool(f.write, chunk)
+            offset += len(chunk)
+        await run_in_threadpool(_sincronizar, f)
+
+    return {"upload_id": upload_id, "offset": offset, "size": size}
+
+@router.post("/cargas/{upload_id}/completar")
+def completar_carga(
+    upload_id: str,
+    x_admin_token: str | None = Header(default=None),
+):
+    verificar_admin_token(x_admin_token)
+    estado = _estado_upload(upload_id)
+    if estado["offset"] != estado["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"error": "Subida incompleta.", "offset": estado["offset"], "size": estado["size"]},
+        )
+
+    _, data_path = _upload_paths(upload_id)
+    h = hashlib.sha256()
+    with open(data_path, "rb") as f:
+        while chunk := f.read(READ_CHUNK):
+            h.update(chunk)
+    sha256 = h.hexdigest()
+
+    if estado.get("sha256") and estado["sha256"].lower() != sha256:
+        raise HTTPException(status_code=400, detail="El SHA-256 no coincide con el declarado.")
+
+    previo = _carga_repetida(sha256)
+    if previo is None:
+        # Por handle: pandas detecta el formato por contenido, no por "data.part"
+        with open(data_path, "rb") as f:
+            df = _leer_archivo(f, estado["filename"])
+        previo = _cargar(df, sha256, estado["filename"])
 
-    return {"ok": True, "filas_cargadas": int(len(df)), "dia_forzado": str(df["dia"].iloc[0])}
+    shutil.rmtree(data_path.parent, ignore_errors=True)
+    return previo
@@ -1,36 +1,136 @@
-﻿from fastapi import FastAPI, HTTPException
+﻿import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from db import fetch_avance_by_dni
-from schemas import AvanceClubPowerResponse
+import db
+from db import (
+    fetch_avance_by_dni,
+    buscar_avance_por_nombre,
+    warm_pool,
+    start_pool_keepalive,
+    stop_pool_keepalive,
+    pool_status,
+    check_readiness,
+)
+from schemas import AvanceClubPowerResponse, AvanceBusquedaItem
+from snapshot_bus import listener as snapshot_listener
+from avance_cache import avance_cache
 import os
 
 from admin_upload import router as admin_router
+from admin_analytics import router as analytics_router
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Abrir el pool antes de recibir tráfico (conexión + TLS ya pagados)
+    try:
+        print(f"🔥 Pool pre-calentado: {warm_pool()} conexiones")
+    except Exception as e:
+        print(f"⚠️ No se pudo pre-calentar el pool: {e}")
+    start_pool_keepalive()
+    snapshot_listener.start()
+    yield
+    snapshot_listener.stop()
+    stop_pool_keepalive()
 
-app = FastAPI(title="Club Power API")
+app = FastAPI(title="Club Power API", lifespan=lifespan)
 
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN", "*")
 
+# Comentario SSE periódico para que proxies no corten conexiones inactivas
+SSE_HEARTBEAT_SECONDS = 15
+
 # Configuración de CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[FRONTEND_ORIGIN] if FRONTEND_ORIGIN != "*" else ["*"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["*", "X-Admin-Token", "Content-Type"],
+    allow_methods=["GET", "POST", "PUT", "OPTIONS"],
+    allow_headers=["*", "X-Admin-Token", "Content-Type", "Upload-Offset"],
 )
 
 app.include_router(admin_router)
+app.include_router(analytics_router)
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
-@app.get("/avance/{dni}", response_model=AvanceClubPowerResponse)
-def get_avance(dni: str):
+@app.get("/ready")
+def ready():
+    # A diferencia de /health, toca la BD: el orquestador solo enruta
+    # tráfico a workers con BD alcanzable y pool caliente.
+    # snapshot_cargado/dia son solo informativos: entre medianoche y la
+    # carga del día no hay D-1, y un 503 ahí sacaría a todos los workers
+    # (incluido /admin/cargar-base, que es lo que lo arregla).
+    estado = check_readiness()
+    estado["pool"] = pool_status()
+    estado["listener"] = snapshot_listener.conectado
+    estado["cache"] = avance_cache.stats()
+    estado["pool_caliente"] = db.pool_caliente
+    listo = estado["db"] and db.pool_caliente
+    estado["status"] = "ready" if listo else "not_ready"
+    return JSONResponse(status_code=200 if listo else 503, content=estado)
+
+def _valida_dni(dni: str):
     if not dni.isdigit() or not (6 <= len(dni) <= 12):
         raise HTTPException(status_code=400, detail="DNI inválido")
 
-    data = fetch_avance_by_dni(dni)
+# Las rutas fijas van antes de /avance/{dni} para que no se tomen como DNI
+@app.get("/avance/stream")
+async def stream_avance(request: Request, dni: str | None = None):
+    """
+    SSE: emite un evento "snapshot" cada vez que se confirma una carga
+    (cargar_base / import_puntos). Filtro opcional: ?dni=123456,234567
+    """
+    filtro = None
+    if dni:
+        filtro = {d.strip() for d in dni.split(",") if d.strip()}
+        for d in filtro:
+            _valida_dni(d)
+
+    async def eventos():
+        q = snapshot_listener.subscribe(filtro)
+        try:
+            yield f"retry: {SSE_HEARTBEAT_SECONDS * 1000}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    ev = await asyncio.wait_for(q.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: snapshot\nid: {ev['version']}\ndata: {json.dumps(ev)}\n\n"
+        finally:
+            snapshot_listener.unsubscribe(q)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/avance/buscar", response_model=list[AvanceBusquedaItem])
+def buscar_avance(q: str, limit: int = Query(default=20, ge=1, le=50)):
+    """
+    Búsqueda por nombre sin tildes (prefijo + difusa).
+    Medido con 1M filas: prefijos y palabras sueltas ~1-6 ms; varias
+    palabras con errores de tipeo (p.ej. "rodrigez castiyo") pueden
+    tardar 100-450 ms, porque el KNN del GiST recorre más páginas.
+    """
+    q = " ".join(q.split())
+    # Con menos de 3 caracteres el índice trigram no filtra nada
+    if len(q) < 3:
+        raise HTTPException(status_code=400, detail="La búsqueda requiere al menos 3 caracteres")
+
+    return buscar_avance_por_nombre(q, limit)
+
+@app.get("/avance/{dni}", response_model=AvanceClubPowerResponse)
+def get_avance(dni: str):
+    _valida_dni(dni)
+
+    data = avance_cache.get_or_load(dni, fetch_avance_by_dni)
     if not data:
         raise HTTPException(status_code=404, detail="No encontrado")
 
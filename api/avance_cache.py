@@ -0,0 +1,79 @@
+# api/avance_cache.py
+# -------------------------------------------------------------
+# Caché en memoria (por proceso) delante de fetch_avance_by_dni.
+#
+# Es segura con varios workers/réplicas porque se invalida con los
+# eventos de snapshot_bus (LISTEN/NOTIFY): cada escritura publica los
+# DNIs cambiados o un flush total. Por eso el TTL puede ser largo.
+# -------------------------------------------------------------
+import os
+import threading
+import time
+
+from snapshot_bus import listener
+
+TTL_SECONDS = int(os.getenv("AVANCE_CACHE_TTL_SECONDS", str(6 * 3600)))
+MAX_ENTRIES = int(os.getenv("AVANCE_CACHE_MAX_ENTRIES", "100000"))
+
+# Marca para cachear también "DNI no encontrado"
+_NO_ENCONTRADO = object()
+
+
+class AvanceCache:
+    def __init__(self, ttl: int, max_entries: int):
+        self._ttl = ttl
+        self._max = max_entries
+        self._data = {}  # dni -> (expira_en, valor)
+        self._lock = threading.Lock()
+        # Sube con cada invalidación: una lectura que empezó antes no
+        # debe guardar su resultado (podría ser el valor viejo).
+        self._generacion = 0
+        self.version = None
+
+    def get_or_load(self, dni: str, loader):
+        # Sin LISTEN activo no nos enteraríamos de cambios: ni leer ni
+        # guardar. Al reconectar llega un flush total (ver SnapshotListener).
+        if not listener.conectado:
+            return loader(dni)
+
+        ahora = time.monotonic()
+        with self._lock:
+            hit = self._data.get(dni)
+            if hit and hit[0] > ahora:
+                return None if hit[1] is _NO_ENCONTRADO else hit[1]
+            generacion = self._generacion
+
+        valor = loader(dni)
+
+        # Pudo caerse durante la lectura
+        if not listener.conectado:
+            return valor
+
+        with self._lock:
+            if generacion == self._generacion:
+                if len(self._data) >= self._max:
+                    self._data.clear()
+                self._data[dni] = (ahora + self._ttl, _NO_ENCONTRADO if valor is None else valor)
+        return valor
+
+    def invalidar(self, evento: dict):
+        # Los "snapshot" solo avisan a /avance/stream; lo que cambió ya
+        # llegó en los "invalidar" de la misma transacción.
+        if evento.get("tipo") != "invalidar":
+            return
+        with self._lock:
+            self._generacion += 1
+            self.version = evento.get("version", self.version)
+            if evento.get("full"):
+                self._data.clear()
+            else:
+                for dni in evento.get("dnis") or []:
+                    self._data.pop(dni, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._data), "version": self.version}
+
+
+avance_cache = AvanceCache(TTL_SECONDS, MAX_ENTRIES)
+listener.add_callback(avance_cache.invalidar)
@@ -1,5 +1,7 @@
 ﻿# db.py
 import os
+import threading
+from contextlib import ExitStack
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
@@ -17,15 +19,123 @@ if not DB_URL:
 # Ajustar el driver para usar psycopg
 SQLA_URL = DB_URL.replace("postgresql://", "postgresql+psycopg://", 1)
 
+POOL_SIZE = 5
+
 # Crear el motor de conexión
+# Sin pool_pre_ping: el ping por checkout suma un round-trip a cada
+# consulta. Las conexiones se validan en segundo plano (ver keepalive).
 engine = create_engine(
     SQLA_URL,
-    pool_pre_ping=True,
-    pool_size=5,
+    pool_size=POOL_SIZE,
     max_overflow=5,
     pool_recycle=1800,
 )
 
+# Cada cuánto se validan las conexiones inactivas del pool (segundos)
+POOL_KEEPALIVE_SECONDS = int(os.getenv("POOL_KEEPALIVE_SECONDS", "30"))
+
+_keepalive_stop = threading.Event()
+_keepalive_thread = None
+
+# True en cuanto el pool abrió al menos una conexión que respondió
+pool_caliente = False
+
+# -------------------------------------------------------------
+# Pool: pre-calentado, validación en segundo plano y estado
+# -------------------------------------------------------------
+def warm_pool(n: int = POOL_SIZE) -> int:
+    """
+    Abre (o reutiliza) n conexiones a la vez y ejecuta SELECT 1 en cada una.
+    Si una conexión está caída, SQLAlchemy la invalida al detectar el error
+    de desconexión y el siguiente checkout abre una nueva.
+    Devuelve cuántas conexiones respondieron bien.
+    """
+    global pool_caliente
+    ok = 0
+    with ExitStack() as stack:
+        for _ in range(n):
+            try:
+                conn = stack.enter_context(engine.connect())
+                conn.execute(text("SELECT 1"))
+                ok += 1
+            except Exception as e:
+                print(f"⚠️ Conexión del pool inválida: {e}")
+    pool_caliente = pool_caliente or ok > 0
+    return ok
+
+
+def _ping_idle():
+    """
+    Valida las conexiones libres de a una (checkout, SELECT 1, devolver).
+    QueuePool es FIFO: repetirlo checkedin() veces recorre todas, y nunca
+    se retiene más de una, así una petición concurrente no cae en overflow.
+    """
+    for _ in range(engine.pool.checkedin()):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as e:
+            print(f"⚠️ Conexión del pool inválida: {e}")
+
+
+def _keepalive_loop():
+    while not _keepalive_stop.wait(POOL_KEEPALIVE_SECONDS):
+        # Si la BD no respondía al arrancar, seguir intentando calentar
+        if not pool_caliente:
+            warm_pool()
+        else:
+            _ping_idle()
+
+
+def start_pool_keepalive():
+    global _keepalive_thread
+    if _keepalive_thread and _keepalive_thread.is_alive():
+        return
+    _keepalive_stop.clear()
+    _keepalive_thread = threading.Thread(target=_keepalive_loop, name="pool-keepalive", daemon=True)
+    _keepalive_thread.start()
+
+
+def stop_pool_keepalive():
+    _keepalive_stop.set()
+
+
+def pool_status() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+
+def check_readiness() -> dict:
+    """
+    Estado para /ready: BD alcanzable y snapshot vigente (dia = D-1) cargado.
+    Se usa CURRENT_DATE - 1 de la BD, igual que el CHECK ck_dia_d_menos_1.
+    """
+    out = {"db": False, "snapshot_cargado": False, "dia": None}
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(
+                text("""
+                    SELECT
+                        CURRENT_DATE - 1 AS dia,
+                        EXISTS (
+                            SELECT 1 FROM public.club_power_avance
+                            WHERE dia = CURRENT_DATE - 1
+                        ) AS cargado
+                """)
+            ).mappings().first()
+        out["db"] = True
+        out["dia"] = str(row["dia"])
+        out["snapshot_cargado"] = bool(row["cargado"])
+    except Exception as e:
+        # /ready no tiene auth: el detalle (host, puerto) solo va al log
+        print(f"⚠️ /ready: BD no disponible: {e}")
+    return out
+
 # -------------------------------------------------------------
 # Función para obtener el avance CLUB POWER por DNI
 # -------------------------------------------------------------
@@ -74,3 +184,59 @@ def fetch_avance_by_dni(dni: str):
             out[k] = int(out.get(k) or 0)
 
         return out
+
+
+# -------------------------------------------------------------
+# Búsqueda de asesores por nombre (sin tildes, prefijo y difusa)
+# Dos ramas acotadas por índice, ambas con LIMIT dentro del índice:
+# - prefijo: rango sobre el btree ix_club_power_avance_nombre_prefijo
+#   (COLLATE "C"), recorrido en orden, para que LIMIT corte el escaneo;
+# - difusa: GiST ix_club_power_avance_nombre_gist (gist_trgm_ops) con
+#   orden KNN por distancia de palabra (<<->).
+# Ambos índices los crea migrate_schema.py (m007) sobre f_unaccent(lower(nombre)).
+# -------------------------------------------------------------
+def buscar_avance_por_nombre(q: str, limit: int = 20):
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+                SELECT dni, nombre, dia, score, grupo
+                FROM (
+                    (
+                        SELECT dni, nombre, dia, 1.0 AS score, 0 AS grupo
+                        FROM public.club_power_avance
+                        -- Rango en vez de LIKE: sigue siendo indexable con el
+                        -- plan genérico de una sentencia preparada.
+                        WHERE (public.f_unaccent(lower(nombre)) COLLATE "C")
+                              >= public.f_unaccent(lower(:q))
+                          AND (public.f_unaccent(lower(nombre)) COLLATE "C")
+                              < public.f_unaccent(lower(:q)) || chr(1114111)
+                        ORDER BY public.f_unaccent(lower(nombre)) COLLATE "C"
+                        LIMIT :limit
+                    )
+                    UNION ALL
+                    (
+                        SELECT dni, nombre, dia,
+                               1 - (public.f_unaccent(lower(:q)) <<-> public.f_unaccent(lower(nombre))) AS score,
+                               1 AS grupo
+                        FROM public.club_power_avance
+                        WHERE public.f_unaccent(lower(:q)) <% public.f_unaccent(lower(nombre))
+                        ORDER BY public.f_unaccent(lower(:q)) <<-> public.f_unaccent(lower(nombre))
+                        LIMIT :limit
+                    )
+                ) r
+                ORDER BY grupo, score DESC, nombre
+            """),
+            {"q": q, "limit": limit},
+        ).mappings().all()
+
+        # Un prefijo también suele aparecer en la rama difusa: quedarse con el primero
+        out = {}
+        for r in rows:
+            if r["dni"] not in out:
+                out[r["dni"]] = {
+                    "dni": r["dni"],
+                    "nombre": r["nombre"],
+                    "dia": r["dia"],
+                    "score": float(r["score"] or 0),
+                }
+        return list(out.values())[:limit]
@@ -5,6 +5,8 @@ import pandas as pd
 from sqlalchemy import text
 from dotenv import load_dotenv
 from db import engine
+import snapshot_bus
+from snapshot_archive import archivar_snapshot
 
 load_dotenv(dotenv_path=Path(__file__).parent / ".env", override=True)
 
@@ -175,6 +177,7 @@ def upsert_chunk(conn, chunk: pd.DataFrame) -> int:
             updated_at = now();
     """)
     conn.execute(sql, chunk.to_dict(orient="records"))
+    snapshot_bus.track_dnis(conn, chunk["dni"])
     return len(chunk)
 
 
@@ -217,12 +220,25 @@ def main():
                 n = upsert_chunk(conn, ch)
                 procesadas += n
                 print(f"   → {procesadas:,}/{total:,} filas procesadas...")
+            # El snapshot vigente ya no es el de la última carga por /admin:
+            # un reintento de ese archivo debe volver a cargarse.
+            conn.execute(text("DELETE FROM public.club_power_cargas WHERE dia = :dia"), {"dia": df["dia"].iloc[0]})
+            # Un solo aviso por transacción: DNIs puntuales o flush total
+            snapshot_bus.publish_invalidation(conn, "import_puntos")
+            snapshot_bus.publish(conn, "import_puntos", dia=df["dia"].iloc[0], filas=procesadas)
     except Exception as e:
         print(f"❌ Error durante el upsert: {e}")
         sys.exit(4)
 
     print(f"✅ Upsert completado. Filas procesadas: {procesadas:,}")
 
+    try:
+        # Upsert parcial: se fusiona con lo ya archivado para ese dia
+        destino = archivar_snapshot(df, merge=True)
+        print(f"📦 Snapshot archivado en {destino}")
+    except Exception as e:
+        print(f"⚠️ No se pudo archivar el snapshot: {e}")
+
 
 if __name__ == "__main__":
     main()
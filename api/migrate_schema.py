@@ -1,36 +1,247 @@
 # api/migrate_schema.py
+# -------------------------------------------------------------
+# Runner de migraciones versionadas (reemplaza migrate_add_metas.py
+# y los ensure_* sueltos).
+#
+#   python migrate_schema.py            -> aplica las pendientes
+#   python migrate_schema.py --status   -> lista aplicadas/pendientes
+#
+# Pensado para correr en horario de atención sin bloquear /avance:
+# - Libro public.schema_migrations: cada versión se aplica una sola vez.
+# - Catálogo leído en UNA consulta (columnas, índices, constraints).
+# - lock_timeout corto + reintentos: si la tabla está ocupada, se espera
+#   y se reintenta en vez de encolar a todas las lecturas detrás del ALTER.
+# - CREATE/DROP INDEX CONCURRENTLY, constraints NOT VALID + VALIDATE,
+#   SET NOT NULL apoyado en un CHECK validado y backfill por lotes.
+# - Al final se listan índices redundantes (prefijo de otro índice).
+# -------------------------------------------------------------
+import os
+import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from dotenv import load_dotenv
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from db import engine
+import snapshot_bus
 
 load_dotenv(dotenv_path=Path(__file__).parent / ".env", override=True)
 
 TABLE = "club_power_avance"
+LEDGER = "schema_migrations"
 
 TARGET = {
     "dni_len": 20,
     "nombre_len": 120,
 }
 
-def col_info(conn, table, column):
-    q = text("""
-        SELECT data_type,
-               udt_name,
-               character_maximum_length AS char_len,
-               numeric_precision,
-               numeric_scale,
-               is_nullable,
-               column_default
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-          AND table_name = :t
-          AND column_name = :c
-        LIMIT 1
-    """)
-    return conn.execute(q, {"t": table, "c": column}).mappings().first()
-
-def ensure_table(conn):
+COUNTERS = ["pp_total", "pp_vr", "porta_pp", "ss_total", "ss_vr", "opp", "oss"]
+METAS = ["meta_ene_pp", "meta_ene_ss", "meta_feb_pp", "meta_feb_ss"]
+
+# Tiempo máximo esperando un lock antes de rendirse (y reintentar)
+LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "3s")
+# Tope por sentencia; solo CONCURRENTLY y VALIDATE CONSTRAINT (que no
+# bloquean lecturas ni escrituras) corren sin topes, ver sin_timeouts
+STATEMENT_TIMEOUT = os.getenv("MIGRATION_STATEMENT_TIMEOUT", "60s")
+LOCK_RETRIES = int(os.getenv("MIGRATION_LOCK_RETRIES", "10"))
+
+BACKFILL_BATCH = 5000
+
+# Un solo runner a la vez (deploys o release phases simultáneos)
+MIGRATION_LOCK_KEY = 740_002
+MIGRATION_LOCK_POLL_SECONDS = 2
+
+
+# -------------------------------------------------------------
+# Catálogo (una sola consulta)
+# -------------------------------------------------------------
+CATALOG_SQL = text("""
+    SELECT
+        (
+            SELECT coalesce(json_agg(json_build_object(
+                'table', c.relname,
+                'column', a.attname,
+                'type', format_type(a.atttypid, a.atttypmod),
+                'char_len', CASE WHEN a.atttypid = 'varchar'::regtype AND a.atttypmod > 0
+                                 THEN a.atttypmod - 4 END,
+                'not_null', a.attnotnull,
+                'default', pg_get_expr(d.adbin, d.adrelid)
+            )), '[]'::json)
+            FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+            WHERE n.nspname = 'public'
+              AND c.relkind = 'r'
+              AND a.attnum > 0
+              AND NOT a.attisdropped
+        ) AS columns,
+        (
+            SELECT coalesce(json_agg(json_build_object(
+                'name', ic.relname,
+                'table', tc.relname,
+                'valid', i.indisvalid,
+                'unique', i.indisunique,
+                'am', am.amname,
+                'keys', (
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+                    LEFT JOIN pg_attribute a
+                           ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                    WHERE k.ord <= i.indnkeyatts
+                ),
+                'expr', i.indexprs IS NOT NULL,
+                'partial', i.indpred IS NOT NULL,
+                'constraint', con.conname
+            )), '[]'::json)
+            FROM pg_index i
+            JOIN pg_class ic ON ic.oid = i.indexrelid
+            JOIN pg_class tc ON tc.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = tc.relnamespace
+            JOIN pg_am am ON am.oid = ic.relam
+            LEFT JOIN pg_constraint con
+                   ON con.conindid = i.indexrelid AND con.contype IN ('p', 'u', 'x')
+            WHERE n.nspname = 'public'
+        ) AS indexes,
+        (
+            SELECT coalesce(json_agg(json_build_object(
+                'name', con.conname,
+                'table', c.relname,
+                'type', con.contype,
+                'valid', con.convalidated
+            )), '[]'::json)
+            FROM pg_constraint con
+            JOIN pg_class c ON c.oid = con.conrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public'
+        ) AS constraints
+""")
+
+
+class Catalogo:
+    def __init__(self, conn):
+        row = conn.execute(CATALOG_SQL).mappings().first()
+        self.columns = {(c["table"], c["column"]): c for c in row["columns"]}
+        self.indexes = {i["name"]: dict(i, keys=i["keys"] or []) for i in row["indexes"]}
+        self.constraints = {c["name"]: c for c in row["constraints"]}
+
+    def column(self, table, column):
+        return self.columns.get((table, column))
+
+    def has_table(self, table):
+        return any(t == table for t, _ in self.columns)
+
+    def redundant_indexes(self):
+        """
+        (redundante, cubierto_por): btree cuyas claves son prefijo de otro
+        btree de la misma tabla. Los que respaldan un PK/UNIQUE se omiten.
+        """
+        simples = [
+            i for i in self.indexes.values()
+            if i["am"] == "btree" and i["valid"] and not i["expr"] and not i["partial"]
+        ]
+        out = []
+        for a in simples:
+            if a["constraint"]:
+                continue
+            for b in simples:
+                if a is b or a["table"] != b["table"]:
+                    continue
+                if len(a["keys"]) > len(b["keys"]) or b["keys"][:len(a["keys"])] != a["keys"]:
+                    continue
+                # Un UNIQUE solo lo cubre otro UNIQUE con las mismas claves
+                if a["unique"] and not (b["unique"] and a["keys"] == b["keys"]):
+                    continue
+                # Dos idénticos no únicos: marcar solo uno
+                if a["keys"] == b["keys"] and not b["constraint"] and a["unique"] == b["unique"] and a["name"] < b["name"]:
+                    continue
+                out.append((a["name"], b["name"]))
+                break
+        return out
+
+
+# -------------------------------------------------------------
+# Operaciones online
+# -------------------------------------------------------------
+@contextmanager
+def sin_timeouts(conn):
+    # Solo para CONCURRENTLY / VALIDATE: toman SHARE UPDATE EXCLUSIVE, que no
+    # choca con lecturas ni escrituras, pero tardan y esperan a que terminen
+    # las transacciones en curso (p.ej. una carga) sin bloquear /avance.
+    conn.execute(text("SET statement_timeout = 0;"))
+    conn.execute(text("SET lock_timeout = 0;"))
+    try:
+        yield
+    finally:
+        conn.execute(text(f"SET statement_timeout = '{STATEMENT_TIMEOUT}';"))
+        conn.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}';"))
+
+
+def create_index_concurrently(conn, cat, name, definition, unique=False):
+    # Un CONCURRENTLY que falló deja el índice INVALID: se borra y se rehace
+    idx = cat.indexes.get(name)
+    if idx and idx["valid"]:
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    with sin_timeouts(conn):
+        if idx:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS public.{name};"))
+            print(f"🧹 Índice inválido eliminado: {name}")
+        conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON public.{definition};"))
+    print(f"📇 Índice creado: {name}")
+
+
+def add_check_online(conn, cat, table, name, expr):
+    # ADD ... NOT VALID toma el lock solo un instante;
+    # VALIDATE recorre la tabla sin bloquear lecturas ni escrituras.
+    con = cat.constraints.get(name)
+    if not con:
+        conn.execute(text(f"ALTER TABLE public.{table} ADD CONSTRAINT {name} CHECK ({expr}) NOT VALID;"))
+    if not con or not con["valid"]:
+        with sin_timeouts(conn):
+            conn.execute(text(f"ALTER TABLE public.{table} VALIDATE CONSTRAINT {name};"))
+        print(f"✔️ Constraint validada: {name}")
+
+
+def backfill_nulls(conn, table, col, value_sql):
+    # Por lotes, cada uno en su propia transacción (conn en AUTOCOMMIT)
+    while True:
+        n = conn.execute(text(f"""
+            UPDATE public.{table} SET {col} = {value_sql}
+            WHERE id IN (
+                SELECT id FROM public.{table} WHERE {col} IS NULL LIMIT {BACKFILL_BATCH}
+            );
+        """)).rowcount
+        if not n:
+            return
+
+
+def set_not_null_online(conn, cat, table, col, default_sql):
+    info = cat.column(table, col)
+    if not info:
+        return
+    conn.execute(text(f"ALTER TABLE public.{table} ALTER COLUMN {col} SET DEFAULT {default_sql};"))
+    if info["not_null"]:
+        return
+
+    backfill_nulls(conn, table, col, default_sql)
+
+    # Con un CHECK (col IS NOT NULL) ya validado, SET NOT NULL no
+    # recorre la tabla (PG12+): solo un lock breve.
+    check = f"ck_{col}_not_null"
+    add_check_online(conn, cat, table, check, f"{col} IS NOT NULL")
+    conn.execute(text(f"ALTER TABLE public.{table} ALTER COLUMN {col} SET NOT NULL;"))
+    conn.execute(text(f"ALTER TABLE public.{table} DROP CONSTRAINT IF EXISTS {check};"))
+    print(f"🔒 {col} SET NOT NULL")
+
+
+# -------------------------------------------------------------
+# Migraciones (no cambiar ni reordenar las ya publicadas; agregar al final)
+# Cada una recibe (conn, catálogo) y debe ser idempotente: una base
+# antigua sin libro las corre todas sobre un esquema ya existente.
+# -------------------------------------------------------------
+def m001_tabla_avance(conn, cat):
     conn.execute(text(f"""
         CREATE TABLE IF NOT EXISTS public.{TABLE} (
             id BIGSERIAL PRIMARY KEY,
@@ -52,110 +263,247 @@ def ensure_table(conn):
         );
     """))
 
-def ensure_column(conn, name, ddl):
-    info = col_info(conn, TABLE, name)
-    if not info:
-        conn.execute(text(f"ALTER TABLE public.{TABLE} ADD COLUMN {name} {ddl};"))
-        print(f"➕ Columna creada: {name} {ddl}")
+    # Columnas faltantes (tabla creada a medias). Con DEFAULT constante,
+    # ADD COLUMN no reescribe la tabla (PG11+).
+    faltantes = {
+        "dni": f"VARCHAR({TARGET['dni_len']}) NOT NULL",
+        "nombre": f"VARCHAR({TARGET['nombre_len']}) NOT NULL",
+        "dia": "DATE NOT NULL",
+        **{c: "INTEGER NOT NULL DEFAULT 0" for c in COUNTERS},
+        "created_at": "TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "updated_at": "TIMESTAMPTZ NOT NULL DEFAULT now()",
+    }
+    for col, ddl in faltantes.items():
+        if cat.has_table(TABLE) and not cat.column(TABLE, col):
+            conn.execute(text(f"ALTER TABLE public.{TABLE} ADD COLUMN IF NOT EXISTS {col} {ddl};"))
+            print(f"➕ Columna creada: {col} {ddl}")
 
-def widen_varchar(conn, name, min_len):
-    info = col_info(conn, TABLE, name)
-    if not info:
-        return
-    if info["data_type"] in ("character varying", "varchar"):
-        cur_len = info["char_len"] or 0
-        if cur_len < min_len:
-            conn.execute(text(f"""
-                ALTER TABLE public.{TABLE}
-                ALTER COLUMN {name} TYPE VARCHAR({min_len});
-            """))
-            print(f"🔁 {name} ensanchada a VARCHAR({min_len})")
-
-def ensure_not_null_default(conn, col, default_sql=None):
-    info = col_info(conn, TABLE, col)
-    if not info:
+
+def m002_metas(conn, cat):
+    # Antes migrate_add_metas.py
+    for col in METAS:
+        conn.execute(text(f"ALTER TABLE public.{TABLE} ADD COLUMN IF NOT EXISTS {col} INTEGER NOT NULL DEFAULT 0;"))
+
+
+def m003_ensanchar_varchar(conn, cat):
+    # Agrandar un VARCHAR solo toca el catálogo (sin reescritura)
+    for col, min_len in (("dni", TARGET["dni_len"]), ("nombre", TARGET["nombre_len"])):
+        info = cat.column(TABLE, col)
+        if info and info["char_len"] is not None and info["char_len"] < min_len:
+            conn.execute(text(f"ALTER TABLE public.{TABLE} ALTER COLUMN {col} TYPE VARCHAR({min_len});"))
+            print(f"🔁 {col} ensanchada a VARCHAR({min_len})")
+
+
+def m004_contadores_not_null(conn, cat):
+    for col in COUNTERS:
+        set_not_null_online(conn, cat, TABLE, col, "0")
+
+
+def m005_uk_dni(conn, cat):
+    # UNIQUE online: índice CONCURRENTLY y luego ADD CONSTRAINT ... USING INDEX
+    if "uk_dni" in cat.constraints:
         return
-    if info["is_nullable"] == "YES":
-        # poner valores nulos a default antes de NOT NULL
-        if default_sql is not None:
-            conn.execute(text(f"UPDATE public.{TABLE} SET {col} = {default_sql} WHERE {col} IS NULL;"))
-        else:
-            conn.execute(text(f"UPDATE public.{TABLE} SET {col} = 0 WHERE {col} IS NULL;"))
-        conn.execute(text(f"ALTER TABLE public.{TABLE} ALTER COLUMN {col} SET NOT NULL;"))
-        print(f"🔒 {col} SET NOT NULL")
-
-    if default_sql is not None:
-        # set default si no coincide
-        conn.execute(text(f"ALTER TABLE public.{TABLE} ALTER COLUMN {col} SET DEFAULT {default_sql};"))
-
-def ensure_constraint(conn, ddl):
-    # ddl debe ser un ALTER TABLE ... ADD CONSTRAINT ...;
-    # lo envolvemos para que sea idempotente
+    create_index_concurrently(conn, cat, "uk_dni", f"{TABLE} (dni)", unique=True)
+    conn.execute(text(f"ALTER TABLE public.{TABLE} ADD CONSTRAINT uk_dni UNIQUE USING INDEX uk_dni;"))
+    print("🔑 Constraint uk_dni creada")
+
+
+def m006_checks(conn, cat):
+    add_check_online(conn, cat, TABLE, "ck_pp_total", "pp_total = pp_vr + porta_pp")
+    add_check_online(conn, cat, TABLE, "ck_ss_total", "ss_total = ss_vr + opp + oss")
+    add_check_online(conn, cat, TABLE, "ck_dia_d_menos_1", "dia = CURRENT_DATE - 1")
+
+
+def m007_busqueda_nombre(conn, cat):
+    # Extensiones para búsqueda por nombre (trigram + sin tildes)
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent;"))
+
+    # unaccent() es STABLE; para poder indexarla se envuelve en una
+    # función IMMUTABLE con el diccionario fijo.
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION public.f_unaccent(text)
+        RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $func$
+            SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+        $func$;
+    """))
+
+    # GET /avance/buscar: ambos índices se recorren en orden y LIMIT corta
+    # el escaneo. GiST permite el orden KNN (<<->) de la rama difusa; el
+    # btree en orden "C" resuelve la rama de prefijo.
+    create_index_concurrently(
+        conn, cat, "ix_club_power_avance_nombre_gist",
+        f"{TABLE} USING gist (public.f_unaccent(lower(nombre)) gist_trgm_ops)",
+    )
+    create_index_concurrently(
+        conn, cat, "ix_club_power_avance_nombre_prefijo",
+        f'{TABLE} ((public.f_unaccent(lower(nombre)) COLLATE "C"))',
+    )
+
+
+def m008_libro_cargas(conn, cat):
+    # Libro de cargas (POST /admin/cargar-base, /admin/cargas); tabla nueva,
+    # su índice puede crearse dentro de la transacción.
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS public.club_power_cargas (
+            sha256 CHAR(64) NOT NULL,
+            dia DATE NOT NULL,
+            filename VARCHAR(255),
+            filas INTEGER NOT NULL,
+            resultado JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (sha256, dia)
+        );
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_club_power_cargas_dia
+        ON public.club_power_cargas (dia, created_at DESC);
+    """))
+
+
+def m009_drop_ix_dni(conn, cat):
+    # Duplicaba el índice de uk_dni: doble costo en cada upsert
+    if "ix_club_power_avance_dni" in cat.indexes:
+        with sin_timeouts(conn):
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS public.ix_club_power_avance_dni;"))
+        print("🗑️ Índice redundante eliminado: ix_club_power_avance_dni")
+
+
+# (versión, nombre, función, transaccional)
+# Las no transaccionales usan CONCURRENTLY o backfill por lotes y
+# corren en AUTOCOMMIT.
+MIGRATIONS = [
+    (1, "tabla_avance", m001_tabla_avance, True),
+    (2, "metas", m002_metas, True),
+    (3, "ensanchar_varchar", m003_ensanchar_varchar, True),
+    (4, "contadores_not_null", m004_contadores_not_null, False),
+    (5, "uk_dni", m005_uk_dni, False),
+    (6, "checks", m006_checks, False),
+    (7, "busqueda_nombre", m007_busqueda_nombre, False),
+    (8, "libro_cargas", m008_libro_cargas, True),
+    (9, "drop_ix_dni", m009_drop_ix_dni, False),
+]
+
+
+# -------------------------------------------------------------
+# Runner
+# -------------------------------------------------------------
+def ensure_ledger(conn):
     conn.execute(text(f"""
-        DO $$
-        BEGIN
-            {ddl}
-        EXCEPTION
-            WHEN duplicate_object THEN
-                NULL;
-        END $$;
+        CREATE TABLE IF NOT EXISTS public.{LEDGER} (
+            version INTEGER PRIMARY KEY,
+            nombre VARCHAR(120) NOT NULL,
+            duracion_ms INTEGER NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
     """))
 
-def ensure_index(conn, name, ddl):
-    # ddl: CREATE INDEX IF NOT EXISTS ...
-    conn.execute(text(ddl))
 
-def main():
-    with engine.begin() as conn:
-        print(f"▶️ Migrando esquema {TABLE}…")
+def applied_versions(conn):
+    return {r[0] for r in conn.execute(text(f"SELECT version FROM public.{LEDGER};"))}
+
+
+def record(conn, version, nombre, duracion_ms):
+    conn.execute(
+        text(f"INSERT INTO public.{LEDGER} (version, nombre, duracion_ms) VALUES (:v, :n, :d);"),
+        {"v": version, "n": nombre, "d": duracion_ms},
+    )
+
+
+def _is_lock_timeout(e: OperationalError) -> bool:
+    return getattr(e.orig, "sqlstate", None) == "55P03"
 
-        ensure_table(conn)
 
-        # Columnas mínimas (por si la tabla existía a medias)
-        ensure_column(conn, "dni", f"VARCHAR({TARGET['dni_len']}) NOT NULL")
-        ensure_column(conn, "nombre", f"VARCHAR({TARGET['nombre_len']}) NOT NULL")
-        ensure_column(conn, "dia", "DATE NOT NULL")
+def run_migration(version, nombre, fn, transactional):
+    t0 = time.monotonic()
+    if transactional:
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';"))
+            conn.execute(text(f"SET LOCAL statement_timeout = '{STATEMENT_TIMEOUT}';"))
+            fn(conn, Catalogo(conn))
+            record(conn, version, nombre, int((time.monotonic() - t0) * 1000))
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            conn.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}';"))
+            conn.execute(text(f"SET statement_timeout = '{STATEMENT_TIMEOUT}';"))
+            fn(conn, Catalogo(conn))
+            record(conn, version, nombre, int((time.monotonic() - t0) * 1000))
+        finally:
+            conn.execute(text("RESET lock_timeout;"))
+            conn.execute(text("RESET statement_timeout;"))
+
 
-        for c in ["pp_total", "pp_vr", "porta_pp", "ss_total", "ss_vr", "opp", "oss"]:
-            ensure_column(conn, c, "INTEGER NOT NULL DEFAULT 0")
+def run_with_retries(version, nombre, fn, transactional):
+    for intento in range(1, LOCK_RETRIES + 1):
+        try:
+            run_migration(version, nombre, fn, transactional)
+            return
+        except OperationalError as e:
+            if not _is_lock_timeout(e) or intento == LOCK_RETRIES:
+                raise
+            espera = min(2 ** intento, 30)
+            print(f"⏳ {version:03d}_{nombre}: tabla ocupada, reintento {intento} en {espera}s")
+            time.sleep(espera)
 
-        ensure_column(conn, "created_at", "TIMESTAMPTZ NOT NULL DEFAULT now()")
-        ensure_column(conn, "updated_at", "TIMESTAMPTZ NOT NULL DEFAULT now()")
 
-        # Asegurar largos
-        widen_varchar(conn, "dni", TARGET["dni_len"])
-        widen_varchar(conn, "nombre", TARGET["nombre_len"])
+def report_redundant_indexes():
+    with engine.connect() as conn:
+        cat = Catalogo(conn)
+    for idx, cubierto in cat.redundant_indexes():
+        print(f"⚠️ Índice redundante: {idx} (cubierto por {cubierto})")
 
-        # Asegurar NOT NULL + DEFAULTS en contadores
-        for c in ["pp_total", "pp_vr", "porta_pp", "ss_total", "ss_vr", "opp", "oss"]:
-            ensure_not_null_default(conn, c, "0")
 
-        # Constraints (idempotentes)
-        ensure_constraint(conn, f"""
-            ALTER TABLE public.{TABLE}
-            ADD CONSTRAINT uk_dni UNIQUE (dni);
-        """)
+def status():
+    with engine.begin() as conn:
+        ensure_ledger(conn)
+        hechas = applied_versions(conn)
+    for version, nombre, _, _ in MIGRATIONS:
+        marca = "✅" if version in hechas else "⏸️"
+        print(f"{marca} {version:03d}_{nombre}")
+
+
+def main():
+    if "--status" in sys.argv[1:]:
+        status()
+        return
+
+    # Lock de sesión en una conexión aparte, tomado ANTES de leer el libro:
+    # un segundo runner espera aquí y luego encuentra todo ya aplicado.
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        # Sondeo con pg_try_advisory_lock: quedarse bloqueado dentro de
+        # pg_advisory_lock deja un snapshot abierto, y el CREATE INDEX
+        # CONCURRENTLY del runner que tiene el lock esperaría por él.
+        while not lock_conn.execute(
+            text("SELECT pg_try_advisory_lock(:k)"), {"k": MIGRATION_LOCK_KEY}
+        ).scalar():
+            print("🔐 Otro runner de migraciones en curso, esperando…")
+            time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        try:
+            with engine.begin() as conn:
+                ensure_ledger(conn)
+                hechas = applied_versions(conn)
 
-        ensure_constraint(conn, f"""
-            ALTER TABLE public.{TABLE}
-            ADD CONSTRAINT ck_pp_total CHECK (pp_total = pp_vr + porta_pp);
-        """)
+            pendientes = [m for m in MIGRATIONS if m[0] not in hechas]
+            print(f"▶️ Migrando esquema {TABLE}… ({len(pendientes)} pendientes)")
 
-        ensure_constraint(conn, f"""
-            ALTER TABLE public.{TABLE}
-            ADD CONSTRAINT ck_ss_total CHECK (ss_total = ss_vr + opp + oss);
-        """)
+            for version, nombre, fn, transactional in pendientes:
+                print(f"→ {version:03d}_{nombre}")
+                run_with_retries(version, nombre, fn, transactional)
 
-        ensure_constraint(conn, f"""
-            ALTER TABLE public.{TABLE}
-            ADD CONSTRAINT ck_dia_d_menos_1 CHECK (dia = CURRENT_DATE - 1);
-        """)
+            if pendientes:
+                # Cambios de esquema: los cachés de otros procesos se vacían
+                with engine.begin() as conn:
+                    snapshot_bus.publish_invalidation(conn, "migrate_schema", full=True)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MIGRATION_LOCK_KEY})
 
-        # Índice útil (además del UNIQUE)
-        ensure_index(conn, "ix_club_power_avance_dni",
-                     f"CREATE INDEX IF NOT EXISTS ix_club_power_avance_dni ON public.{TABLE} (dni);")
+    report_redundant_indexes()
+    print("✅ Migración completada.")
 
-        print("✅ Migración completada.")
 
 if __name__ == "__main__":
     main()
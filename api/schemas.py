@@ -32,3 +32,18 @@ class AvanceClubPowerResponse(BaseModel):
 
     # Auditoría
     updated_at: datetime = Field(..., example="2026-01-06T07:30:12")
+
+
+class AvanceBusquedaItem(BaseModel):
+    # Resultado de búsqueda por nombre (para luego consultar /avance/{dni})
+    dni: str = Field(..., example="666666")
+    nombre: str = Field(..., example="Juan Pérez")
+    dia: date = Field(..., example="2026-01-02")
+    score: float = Field(..., example=0.83)
+
+
+class CargaInicio(BaseModel):
+    # Inicio de una subida reanudable (POST /admin/cargas)
+    filename: str = Field(..., example="avance.xlsx")
+    size: int = Field(..., gt=0, example=314572800)
+    sha256: str | None = Field(default=None, min_length=64, max_length=64)
@@ -0,0 +1,139 @@
+# api/snapshot_archive.py
+# -------------------------------------------------------------
+# Archivo histórico de snapshots en Parquet (zstd), particionado
+# por dia (hive: dia=YYYY-MM-DD/snapshot.parquet).
+#
+# - cargar_base / import_puntos archivan el DataFrame ya limpio
+#   después del COMMIT, así el TRUNCATE no borra la historia.
+#   cargar_base reemplaza la partición del dia (como su TRUNCATE);
+#   import_puntos solo hace upsert, así que se fusiona por dni.
+# - Las consultas analíticas leen de aquí con pyarrow (filtro por
+#   partición + columnas), sin tocar la BD que sirve /avance.
+# -------------------------------------------------------------
+import fcntl
+import os
+import uuid
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", Path(__file__).parent / "archive"))
+
+NUM_COLS = [
+    "pp_total", "pp_vr", "porta_pp",
+    "ss_total", "ss_vr", "opp", "oss",
+    "meta_ene_pp", "meta_ene_ss", "meta_feb_pp", "meta_feb_ss",
+]
+
+# "dia" no va dentro del archivo: sale del nombre de la partición
+FILE_SCHEMA = pa.schema(
+    [("dni", pa.string()), ("nombre", pa.string())]
+    + [(c, pa.int32()) for c in NUM_COLS]
+)
+
+PARTITIONING = ds.partitioning(pa.schema([("dia", pa.date32())]), flavor="hive")
+
+
+def archivar_snapshot(df: pd.DataFrame, merge: bool = False) -> Path:
+    """
+    Escribe el snapshot limpio de un dia. Sin merge, reemplaza la partición
+    (igual que el TRUNCATE + UPSERT de cargar_base). Con merge, las filas se
+    fusionan por dni con lo ya archivado (upsert de import_puntos).
+    """
+    dia = df["dia"].iloc[0]
+    destino = ARCHIVE_DIR / f"dia={dia}" / "snapshot.parquet"
+    destino.parent.mkdir(parents=True, exist_ok=True)
+
+    nuevo = df[FILE_SCHEMA.names]
+
+    # Un escritor por partición: el merge es leer-fusionar-escribir
+    # (pyarrow ignora los archivos que empiezan con ".")
+    with open(destino.parent / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if merge and destino.exists():
+            previo = pq.read_table(destino, schema=FILE_SCHEMA).to_pandas()
+            nuevo = (
+                pd.concat([previo, nuevo], ignore_index=True)
+                .drop_duplicates(subset=["dni"], keep="last")
+                .reset_index(drop=True)
+            )
+
+        tabla = pa.Table.from_pandas(nuevo, schema=FILE_SCHEMA, preserve_index=False)
+
+        # Escribir a temporal único y renombrar: un lector nunca ve un archivo a medias
+        tmp = destino.parent / f".{destino.name}.{uuid.uuid4().hex}.tmp"
+        try:
+            pq.write_table(tabla, tmp, compression="zstd")
+            os.replace(tmp, destino)
+        finally:
+            tmp.unlink(missing_ok=True)
+    return destino
+
+
+def _dataset():
+    if not ARCHIVE_DIR.exists():
+        return None
+    return ds.dataset(
+        ARCHIVE_DIR,
+        format="parquet",
+        partitioning=PARTITIONING,
+    )
+
+
+def _rango(desde: date, hasta: date):
+    return (ds.field("dia") >= pa.scalar(desde, pa.date32())) & (ds.field("dia") <= pa.scalar(hasta, pa.date32()))
+
+
+def resumen_por_dia(desde: date, hasta: date, columnas: list[str] | None = None) -> dict:
+    """
+    Totales por dia y acumulado del rango (p.ej. mes a la fecha).
+    Cada snapshot ya trae el avance acumulado de cada asesor, así que
+    sumar días contaría lo mismo varias veces: el acumulado (avance y
+    metas) son los totales del último dia con datos, en "acumulado_dia".
+    Solo se leen las particiones del rango y las columnas pedidas.
+    """
+    columnas = columnas or NUM_COLS
+    dataset = _dataset()
+    if dataset is None:
+        return {"por_dia": [], "acumulado": {c: 0 for c in columnas}, "acumulado_dia": None}
+
+    tabla = dataset.to_table(columns=["dia", "dni"] + columnas, filter=_rango(desde, hasta))
+
+    agregado = tabla.group_by("dia").aggregate(
+        [("dni", "count")] + [(c, "sum") for c in columnas]
+    ).sort_by("dia")
+
+    por_dia = [
+        {
+            "dia": str(r["dia"]),
+            "asesores": int(r["dni_count"]),
+            **{c: int(r[f"{c}_sum"] or 0) for c in columnas},
+        }
+        for r in agregado.to_pylist()
+    ]
+    ultimo = por_dia[-1] if por_dia else {}
+    return {
+        "por_dia": por_dia,
+        "acumulado": {c: ultimo.get(c, 0) for c in columnas},
+        "acumulado_dia": ultimo.get("dia"),
+    }
+
+
+def tendencia_asesor(dni: str, desde: date, hasta: date, columnas: list[str] | None = None) -> list[dict]:
+    """Serie diaria de un asesor (filtro por dni empujado al escaneo)."""
+    columnas = columnas or NUM_COLS
+    dataset = _dataset()
+    if dataset is None:
+        return []
+
+    tabla = dataset.to_table(
+        columns=["dia", "nombre"] + columnas,
+        filter=_rango(desde, hasta) & (ds.field("dni") == dni),
+    ).sort_by("dia")
+
+    return [dict(r, dia=str(r["dia"])) for r in tabla.to_pylist()]
@@ -0,0 +1,250 @@
+# api/snapshot_bus.py
+# -------------------------------------------------------------
+# Aviso de nuevos snapshots entre procesos vía Postgres LISTEN/NOTIFY.
+#
+# - Los caminos de escritura llaman publish(conn, ...) DENTRO de su
+#   transacción: Postgres entrega el NOTIFY solo si hay COMMIT.
+# - Cada proceso abre UNA conexión dedicada con LISTEN y reparte los
+#   eventos a sus suscriptores asyncio (p.ej. GET /avance/stream) y a los
+#   callbacks registrados (p.ej. invalidación de avance_cache).
+#
+# Tipos de evento (campo "tipo"), con la misma "version" por transacción:
+#   "invalidar" -> cambiaron filas: "dnis" concretos o "full": true.
+#                  Es lo único que usan los cachés.
+#   "snapshot"  -> se confirmó una carga (va después de sus "invalidar");
+#                  "full": false si solo cambiaron los DNIs anunciados.
+# -------------------------------------------------------------
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from db import DB_URL
+
+CHANNEL = "club_power_snapshot"
+
+# Segundos entre reintentos si se cae la conexión de LISTEN
+RECONNECT_SECONDS = 5
+
+# Un socket medio abierto no da error: keepalive TCP + SELECT 1 tras cada
+# espera para detectarlo (y bajar "conectado", del que depende avance_cache)
+LISTEN_CONN_KWARGS = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+    "tcp_user_timeout": 30000,
+    "connect_timeout": 10,
+}
+
+# Eventos pendientes por suscriptor; si un cliente no consume, se descartan
+QUEUE_MAXSIZE = 16
+
+# Versiones cuyos DNIs se guardan hasta que llegue su "snapshot"
+PENDIENTES_MAX = 32
+
+# NOTIFY admite payloads < 8000 bytes: los DNIs se mandan por lotes
+DNIS_POR_NOTIFY = 400
+
+# Por encima de esto es más barato un flush total que evictar uno a uno
+FULL_FLUSH_THRESHOLD = 5000
+
+
+def _version() -> int:
+    return time.time_ns()
+
+
+# Estado por transacción (en conn.info): DNIs cambiados, flush total y
+# una versión común a todos los NOTIFY de esa transacción. Se descarta
+# al terminar la transacción, haya COMMIT o ROLLBACK.
+_TX_KEY = "snapshot_bus"
+
+
+def _tx(conn) -> dict:
+    return conn.info.setdefault(_TX_KEY, {"version": _version(), "dnis": set(), "full": False})
+
+
+@event.listens_for(Engine, "commit")
+@event.listens_for(Engine, "rollback")
+def _fin_tx(conn):
+    conn.info.pop(_TX_KEY, None)
+
+
+def _notify(conn, payload: dict):
+    conn.execute(
+        text("SELECT pg_notify(:canal, :payload)"),
+        {"canal": CHANNEL, "payload": json.dumps(payload)},
+    )
+
+
+def track_dnis(conn, dnis):
+    """Acumula DNIs cambiados en la transacción; se publican con publish_invalidation()."""
+    tx = _tx(conn)
+    if tx["full"]:
+        return
+    tx["dnis"].update(dnis)
+    if len(tx["dnis"]) > FULL_FLUSH_THRESHOLD:
+        tx["full"] = True
+        tx["dnis"].clear()
+
+
+def publish_invalidation(conn, origen: str, full: bool = False):
+    """
+    Publica, una sola vez por transacción, los DNIs acumulados con
+    track_dnis() o un flush total (full=True o demasiados DNIs).
+    Se entrega al hacer COMMIT de conn, igual que publish().
+    """
+    tx = _tx(conn)
+    tx["full"] = tx["full"] or full
+
+    if tx["full"]:
+        _notify(conn, {"tipo": "invalidar", "version": tx["version"], "origen": origen, "full": True})
+        tx["dnis"].clear()
+        return
+
+    dnis = sorted(tx["dnis"])
+    for i in range(0, len(dnis), DNIS_POR_NOTIFY):
+        _notify(conn, {
+            "tipo": "invalidar",
+            "version": tx["version"],
+            "origen": origen,
+            "full": False,
+            "dnis": dnis[i:i + DNIS_POR_NOTIFY],
+        })
+    tx["dnis"].clear()
+
+
+def publish(conn, origen: str, dia=None, filas: int | None = None):
+    """
+    Publica un snapshot nuevo (para /avance/stream). Va después de
+    publish_invalidation(): "full" indica si reemplazó toda la tabla o
+    solo los DNIs ya anunciados con la misma versión.
+    Se entrega al hacer COMMIT de conn.
+    """
+    tx = _tx(conn)
+    _notify(conn, {
+        "tipo": "snapshot",
+        "version": tx["version"],
+        "origen": origen,
+        "dia": str(dia) if dia is not None else None,
+        "filas": filas,
+        "full": tx["full"],
+    })
+
+
+def _offer(q: asyncio.Queue, evento: dict):
+    try:
+        q.put_nowait(evento)
+    except asyncio.QueueFull:
+        pass
+
+
+class SnapshotListener:
+    """Una conexión LISTEN por proceso, N suscriptores asyncio y callbacks."""
+
+    def __init__(self, url: str):
+        self._url = url
+        self._subs = {}  # Queue -> (loop, set de dnis o None)
+        self._callbacks = []
+        # version -> DNIs anunciados en sus "invalidar" (solo el hilo del listener)
+        self._pendientes = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.conectado = False
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, dnis: set[str] | None = None) -> asyncio.Queue:
+        q = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+        with self._lock:
+            self._subs[q] = (asyncio.get_running_loop(), dnis)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        with self._lock:
+            self._subs.pop(q, None)
+
+    def add_callback(self, fn):
+        """fn(evento) se llama desde el hilo del listener para cada evento."""
+        with self._lock:
+            self._callbacks.append(fn)
+
+    def _dispatch(self, evento: dict):
+        with self._lock:
+            subs = list(self._subs.items())
+            callbacks = list(self._callbacks)
+
+        for fn in callbacks:
+            try:
+                fn(evento)
+            except Exception as e:
+                print(f"⚠️ Error en callback de {CHANNEL}: {e}")
+
+        version = evento.get("version")
+
+        # Los "invalidar" puntuales llegan antes que su "snapshot" (mismo
+        # orden que en la transacción): se guardan para filtrar el SSE.
+        if evento.get("tipo") == "invalidar":
+            if not evento.get("full") and version is not None:
+                self._pendientes.setdefault(version, set()).update(evento.get("dnis") or [])
+                while len(self._pendientes) > PENDIENTES_MAX:
+                    self._pendientes.popitem(last=False)
+            return
+
+        # Los clientes SSE solo reciben cargas confirmadas
+        if evento.get("tipo", "snapshot") != "snapshot":
+            return
+
+        cambiados = self._pendientes.pop(version, set())
+        full = evento.get("full", True)
+
+        for q, (loop, dnis) in subs:
+            if not dnis:
+                ev = evento
+            else:
+                # Snapshot completo: afecta a todos los DNIs del filtro
+                afectados = dnis if full else dnis & cambiados
+                if not afectados:
+                    continue
+                ev = dict(evento, dnis=sorted(afectados))
+            loop.call_soon_threadsafe(_offer, q, ev)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self._url, autocommit=True, **LISTEN_CONN_KWARGS) as conn:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    self.conectado = True
+                    # Lo ocurrido mientras no escuchábamos se da por perdido
+                    self._dispatch({"tipo": "invalidar", "version": _version(), "origen": "listener", "full": True})
+                    while not self._stop.is_set():
+                        for n in conn.notifies(timeout=RECONNECT_SECONDS):
+                            try:
+                                evento = json.loads(n.payload)
+                            except ValueError:
+                                continue
+                            self._dispatch(evento)
+                        # Sin esto, un socket muerto solo "expira" sin error
+                        conn.execute("SELECT 1")
+            except Exception as e:
+                print(f"⚠️ LISTEN {CHANNEL} caído, reintentando: {e}")
+                self._stop.wait(RECONNECT_SECONDS)
+            finally:
+                self.conectado = False
+
+
+listener = SnapshotListener(DB_URL.replace("postgresql+psycopg://", "postgresql://", 1))
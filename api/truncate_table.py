@@ -7,6 +7,8 @@ import os
 # Cargar variables de entorno
 load_dotenv(Path(__file__).parent / ".env")
 
+import snapshot_bus  # después del .env: importa db, que exige DB_URL
+
 DB_URL = os.getenv("DB_URL")
 if not DB_URL:
     raise RuntimeError("DB_URL no está definido")
@@ -17,4 +19,7 @@ TABLE_NAME = "club_power_avance"
 
 with engine.begin() as conn:
     conn.execute(text(f"TRUNCATE TABLE public.{TABLE_NAME} RESTART IDENTITY;"))
+    snapshot_bus.publish_invalidation(conn, "truncate_table", full=True)
+    # Sin datos, ninguna carga previa sigue vigente (ver admin_upload)
+    conn.execute(text("DELETE FROM public.club_power_cargas WHERE dia >= CURRENT_DATE - 1;"))
     print(f"✅ Tabla {TABLE_NAME} truncada con éxito.")